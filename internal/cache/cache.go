@@ -1,31 +1,102 @@
 package cache
 
 import (
+	"bufio"
+	"context"
 	"crypto/md5"
 	"encoding/hex"
 	"fmt"
 	"io"
+	"io/fs"
 	"net/http"
 	"os"
 	"path/filepath"
 	"regexp"
 	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	"apt-cache-proxy/internal/config"
 	"apt-cache-proxy/internal/database"
 	"apt-cache-proxy/internal/logger"
+	"apt-cache-proxy/internal/stats"
 )
 
 var (
 	blacklistPatterns []string
 	blacklistMu       sync.RWMutex
+	blacklist         atomic.Value // *blacklistMatcher, rebuilt on every change
+
+	knownDirs sync.Map // shard directories already created
 )
 
+// upstreamClient is shared by all downloads so connections to a mirror stay
+// open between the many small index and package fetches of one apt run.
+// The default transport keeps only 2 idle connections per host.
+var upstreamClient = &http.Client{
+	Transport: newUpstreamTransport(),
+	Timeout:   120 * time.Second, // Increased timeout for large files
+	CheckRedirect: func(req *http.Request, via []*http.Request) error {
+		return nil // Follow redirects
+	},
+}
+
+// cacheWriterPool holds buffers for cache file writes. Upstream reads return
+// a TLS record or a few TCP segments at a time; buffering turns them into
+// one write(2) per 128KB instead of one per read.
+var cacheWriterPool = sync.Pool{
+	New: func() interface{} {
+		return bufio.NewWriterSize(nil, 128*1024)
+	},
+}
+
+func newUpstreamTransport() *http.Transport {
+	t := http.DefaultTransport.(*http.Transport).Clone()
+	t.MaxIdleConns = 256
+	t.MaxIdleConnsPerHost = 64
+	return t
+}
+
+// blacklistMatcher is a precompiled, read-only view of blacklistPatterns
+type blacklistMatcher struct {
+	literals []string       // lowercased substring patterns
+	wildcard *regexp.Regexp // all glob patterns in one expression, nil if none
+}
+
+func init() {
+	blacklist.Store(&blacklistMatcher{})
+}
+
+// rebuildBlacklist recompiles the matcher; callers must hold blacklistMu
+func rebuildBlacklist() {
+	m := &blacklistMatcher{}
+	seen := make(map[string]bool, len(blacklistPatterns))
+	var globs []string
+
+	for _, pattern := range blacklistPatterns {
+		if strings.Contains(pattern, "*") {
+			// Convert glob to regex
+			regexPattern := strings.ReplaceAll(regexp.QuoteMeta(pattern), `\*`, ".*")
+			globs = append(globs, "(?:"+regexPattern+")")
+			continue
+		}
+		literal := strings.ToLower(pattern)
+		if !seen[literal] {
+			seen[literal] = true
+			m.literals = append(m.literals, literal)
+		}
+	}
+
+	if len(globs) > 0 {
+		m.wildcard = regexp.MustCompile("(?i)" + strings.Join(globs, "|"))
+	}
+	blacklist.Store(m)
+}
+
 // LoadBlacklistFromDB loads blacklist patterns from database
 func LoadBlacklistFromDB() error {
-	db := database.Get()
+	db := database.Reader()
 	rows, err := db.Query("SELECT pattern FROM package_blacklist")
 	if err != nil {
 		return err
@@ -43,6 +114,7 @@ func LoadBlacklistFromDB() error {
 		}
 		blacklistPatterns = append(blacklistPatterns, pattern)
 	}
+	rebuildBlacklist()
 
 	log := logger.Get()
 	log.Infof("Loaded %d blacklist patterns", len(blacklistPatterns))
@@ -51,29 +123,26 @@ func LoadBlacklistFromDB() error {
 
 // IsBlacklisted checks if a filename matches any blacklist pattern
 func IsBlacklisted(filename string) bool {
-	blacklistMu.RLock()
-	defer blacklistMu.RUnlock()
+	m := blacklist.Load().(*blacklistMatcher)
 
-	for _, pattern := range blacklistPatterns {
-		if strings.Contains(pattern, "*") {
-			// Convert glob to regex
-			regexPattern := strings.ReplaceAll(pattern, ".", "\\.")
-			regexPattern = strings.ReplaceAll(regexPattern, "*", ".*")
-			if matched, _ := regexp.MatchString("(?i)"+regexPattern, filename); matched {
+	if len(m.literals) > 0 {
+		lower := strings.ToLower(filename)
+		for _, literal := range m.literals {
+			if strings.Contains(lower, literal) {
 				return true
 			}
-		} else if strings.Contains(strings.ToLower(filename), strings.ToLower(pattern)) {
-			return true
 		}
 	}
-	return false
+	return m.wildcard != nil && m.wildcard.MatchString(filename)
 }
 
 // GetCachePath generates a cache file path for a distro and package path
 func GetCachePath(distro, pkgPath string) string {
 	cfg := config.Get()
 	hash := md5.Sum([]byte(pkgPath))
-	hashStr := hex.EncodeToString(hash[:])
+	var hashHex [2 * md5.Size]byte
+	hex.Encode(hashHex[:], hash[:])
+	hashStr := string(hashHex[:])
 	
 	filename := filepath.Base(pkgPath)
 	if filename == "" || filename == "." || filename == "/" {
@@ -81,18 +150,42 @@ func GetCachePath(distro, pkgPath string) string {
 	}
 	
 	cacheDir := filepath.Join(cfg.StoragePathResolved, distro, hashStr[:2])
-	os.MkdirAll(cacheDir, 0755)
+	ensureDir(cacheDir)
 	
-	return filepath.Join(cacheDir, fmt.Sprintf("%s_%s", hashStr, filename))
+	return filepath.Join(cacheDir, hashStr+"_"+filename)
 }
 
-// IsCacheValid checks if a cache file is still valid
-func IsCacheValid(cachePath string) bool {
-	info, err := os.Stat(cachePath)
+// ensureDir creates a shard directory the first time it is seen, so hot
+// paths don't issue a mkdir that fails with EEXIST on every request
+func ensureDir(dir string) {
+	if _, ok := knownDirs.Load(dir); ok {
+		return
+	}
+	if err := os.MkdirAll(dir, 0755); err == nil {
+		knownDirs.Store(dir, struct{}{})
+	}
+}
+
+// OpenValidCache opens a cache file and checks it is still valid using the
+// opened file's own stat. The returned info always describes the returned
+// file, even if a download renames a new copy into place meanwhile, so the
+// body and its validators can't disagree. The caller closes the file.
+func OpenValidCache(cachePath string) (*os.File, os.FileInfo, bool) {
+	file, err := os.Open(cachePath)
 	if err != nil {
-		return false
+		return nil, nil, false
 	}
+	
+	info, err := file.Stat()
+	if err != nil || !checkCacheInfo(cachePath, info) {
+		file.Close()
+		return nil, nil, false
+	}
+	return file, info, true
+}
 
+// checkCacheInfo runs the metadata and age checks on a stat'ed cache file
+func checkCacheInfo(cachePath string, info os.FileInfo) bool {
 	// Check if metadata file exists and matches
 	metaPath := cachePath + ".meta"
 	if metaData, err := os.ReadFile(metaPath); err == nil {
@@ -100,11 +193,7 @@ func IsCacheValid(cachePath string) bool {
 		if _, err := fmt.Sscanf(string(metaData), "%d", &expectedSize); err == nil {
 			// Validate file size matches metadata
 			if info.Size() != expectedSize {
-				// Cache corrupted, remove it
-				log := logger.Get()
-				log.Warnf("Cache size mismatch: %s (expected %d, got %d). Removing corrupted cache.", cachePath, expectedSize, info.Size())
-				os.Remove(cachePath)
-				os.Remove(metaPath)
+				removeCorrupted(cachePath, info, expectedSize)
 				return false
 			}
 		}
@@ -121,16 +210,27 @@ func IsCacheValid(cachePath string) bool {
 	return age < maxAge
 }
 
-// StreamAndCache downloads from upstream and caches the file while streaming to client
-func StreamAndCache(urls []string, cachePath string, headers map[string]string) (*http.Response, error) {
+// removeCorrupted deletes a cache file whose size disagrees with its
+// metadata, unless a download has already replaced it with a new copy
+func removeCorrupted(cachePath string, info os.FileInfo, expectedSize int64) {
 	log := logger.Get()
 	
-	// Clean up any leftover temp file from previous failed download
-	tempPath := cachePath + ".tmp"
-	if _, err := os.Stat(tempPath); err == nil {
-		os.Remove(tempPath)
+	if current, err := os.Stat(cachePath); err != nil || !os.SameFile(current, info) {
+		return
 	}
 	
+	log.Warnf("Cache size mismatch: %s (expected %d, got %d). Removing corrupted cache.", cachePath, expectedSize, info.Size())
+	if os.Remove(cachePath) == nil {
+		stats.RecordFileRemove(cachePath, info.Size())
+	}
+	os.Remove(cachePath + ".meta")
+}
+
+// StreamAndCache downloads from upstream and caches the file while streaming to client
+// using the same headers for every mirror tried, so they must not be modified meanwhile
+func StreamAndCache(urls []string, cachePath string, headers http.Header) (*http.Response, error) {
+	log := logger.Get()
+	
 	var lastErr error
 	errorCount := 0
 	
@@ -156,6 +256,7 @@ func StreamAndCache(urls []string, cachePath string, headers map[string]string)
 type streamingReader struct {
 	resp          *http.Response
 	file          *os.File
+	buf           *bufio.Writer // buffers writes to file
 	tempPath      string
 	finalPath     string
 	teeReader     io.Reader
@@ -183,8 +284,17 @@ func (sr *streamingReader) Close() error {
 	
 	// Close and rename file
 	if sr.file != nil {
+		flushErr := sr.buf.Flush()
+		sr.buf.Reset(nil)
+		cacheWriterPool.Put(sr.buf)
 		sr.file.Close()
 		
+		if flushErr != nil {
+			log.Warnf("Failed to write cache file: %v", flushErr)
+			os.Remove(sr.tempPath)
+			return nil
+		}
+		
 		// Check if file was fully written
 		info, err := os.Stat(sr.tempPath)
 		if err != nil {
@@ -215,6 +325,9 @@ func (sr *streamingReader) Close() error {
 			metaFile.Close()
 		}
 		
+		// An expired copy being replaced leaves the file stats
+		previous, prevErr := os.Lstat(sr.finalPath)
+		
 		// Atomic rename - only cache if download was complete
 		if err := os.Rename(sr.tempPath, sr.finalPath); err != nil {
 			log.Warnf("Failed to cache file: %v", err)
@@ -222,36 +335,29 @@ func (sr *streamingReader) Close() error {
 			os.Remove(metaPath)
 		} else {
 			log.Infof("Cached: %s (%d bytes)", sr.finalPath, info.Size())
+			if prevErr == nil {
+				stats.RecordFileRemove(sr.finalPath, previous.Size())
+			}
+			stats.RecordFileAdd(sr.finalPath, info.Size())
 		}
 	}
 	
 	return nil
 }
 
-func downloadAndCache(url, cachePath string, headers map[string]string) (*http.Response, error) {
+func downloadAndCache(url, cachePath string, headers http.Header) (*http.Response, error) {
 	log := logger.Get()
 	log.Infof("Downloading: %s", url)
 	
-	client := &http.Client{
-		Timeout: 120 * time.Second, // Increased timeout for large files
-		CheckRedirect: func(req *http.Request, via []*http.Request) error {
-			return nil // Follow redirects
-		},
-	}
-	
 	req, err := http.NewRequest("GET", url, nil)
 	if err != nil {
 		return nil, err
 	}
 	
-	// Copy headers
-	for k, v := range headers {
-		if strings.ToLower(k) != "host" {
-			req.Header.Set(k, v)
-		}
-	}
+	// Headers were filtered by the caller; the transport only reads them
+	req.Header = headers
 	
-	resp, err := client.Do(req)
+	resp, err := upstreamClient.Do(req)
 	if err != nil {
 		// Check for DNS errors
 		if strings.Contains(err.Error(), "no such host") || 
@@ -266,21 +372,26 @@ func downloadAndCache(url, cachePath string, headers map[string]string) (*http.R
 		return nil, fmt.Errorf("HTTP %d", resp.StatusCode)
 	}
 	
-	// Create temp file for atomic write
-	tempPath := cachePath + ".tmp"
-	file, err := os.Create(tempPath)
+	// Create temp file for atomic write. The name is unique per download so
+	// concurrent misses for the same file can't write into each other.
+	file, err := createTempFile(cachePath)
 	if err != nil {
 		resp.Body.Close()
 		return nil, err
 	}
+	tempPath := file.Name()
+	
+	buf := cacheWriterPool.Get().(*bufio.Writer)
+	buf.Reset(file)
 	
 	// Create streaming reader that writes to cache while being read
 	sr := &streamingReader{
 		resp:         resp,
 		file:         file,
+		buf:          buf,
 		tempPath:     tempPath,
 		finalPath:    cachePath,
-		teeReader:    io.TeeReader(resp.Body, file),
+		teeReader:    io.TeeReader(resp.Body, buf),
 		expectedSize: resp.ContentLength,
 		writtenBytes: 0,
 	}
@@ -300,6 +411,28 @@ func downloadAndCache(url, cachePath string, headers map[string]string) (*http.R
 	return streamResp, nil
 }
 
+// createTempFile creates a uniquely named temp file next to cachePath
+func createTempFile(cachePath string) (*os.File, error) {
+	dir, base := filepath.Split(cachePath)
+	file, err := os.CreateTemp(dir, base+".*.tmp")
+	if os.IsNotExist(err) {
+		// Shard directory was removed behind our back; recreate it
+		os.MkdirAll(dir, 0755)
+		file, err = os.CreateTemp(dir, base+".*.tmp")
+	}
+	if err != nil {
+		return nil, err
+	}
+	
+	// CreateTemp uses 0600; cached files keep the usual 0644
+	if err := file.Chmod(0644); err != nil {
+		file.Close()
+		os.Remove(file.Name())
+		return nil, err
+	}
+	return file, nil
+}
+
 func createResponseFromFile(cachePath string, statusCode int, originalHeaders http.Header) (*http.Response, error) {
 	file, err := os.Open(cachePath)
 	if err != nil {
@@ -330,8 +463,9 @@ func createResponseFromFile(cachePath string, statusCode int, originalHeaders ht
 	return resp, nil
 }
 
-// CleanOldCache removes old cache files based on retention policy
-func CleanOldCache() error {
+// CleanOldCache removes old cache files based on retention policy. It
+// stops early when ctx is cancelled.
+func CleanOldCache(ctx context.Context) error {
 	cfg := config.Get()
 	log := logger.Get()
 	
@@ -345,21 +479,34 @@ func CleanOldCache() error {
 	cutoffTime := time.Now().Add(-time.Duration(cfg.CacheDays) * 24 * time.Hour)
 	cleanedCount := 0
 	
-	err := filepath.Walk(cfg.StoragePathResolved, func(path string, info os.FileInfo, err error) error {
+	// WalkDir only lstats the entries we ask Info() for; directories are
+	// identified from the readdir type bits alone.
+	err := filepath.WalkDir(cfg.StoragePathResolved, func(path string, d fs.DirEntry, err error) error {
+		if ctxErr := ctx.Err(); ctxErr != nil {
+			return ctxErr
+		}
 		if err != nil {
 			return nil // Skip errors
 		}
 		
-		if info.IsDir() {
+		if d.IsDir() {
 			return nil
 		}
 		
+		info, err := d.Info()
+		if err != nil {
+			return nil // Removed together with its data file
+		}
+		
 		// Check if file is older than cutoff
 		if info.ModTime().Before(cutoffTime) {
 			if err := os.Remove(path); err == nil {
 				// Also remove metadata file if it exists
 				metaPath := path + ".meta"
 				os.Remove(metaPath)
+				if stats.IsCachedFile(d.Name()) {
+					stats.RecordFileRemove(path, info.Size())
+				}
 				cleanedCount++
 			}
 		}
@@ -371,6 +518,44 @@ func CleanOldCache() error {
 	return err
 }
 
+// staleTempAge is how long an untouched download temp file is kept. Live
+// downloads write to theirs continuously, so anything this old was left by
+// a crash or by shutdown cutting a download off.
+const staleTempAge = 1 * time.Hour
+
+// CleanStaleTempFiles removes abandoned download temp files. Unlike
+// CleanOldCache it runs whether or not retention is enabled.
+func CleanStaleTempFiles(ctx context.Context) error {
+	cfg := config.Get()
+	log := logger.Get()
+	
+	cutoffTime := time.Now().Add(-staleTempAge)
+	removedCount := 0
+	
+	err := filepath.WalkDir(cfg.StoragePathResolved, func(path string, d fs.DirEntry, err error) error {
+		if ctxErr := ctx.Err(); ctxErr != nil {
+			return ctxErr
+		}
+		if err != nil || d.IsDir() || !strings.HasSuffix(d.Name(), ".tmp") {
+			return nil
+		}
+		
+		info, err := d.Info()
+		if err != nil {
+			return nil
+		}
+		if info.ModTime().Before(cutoffTime) && os.Remove(path) == nil {
+			removedCount++
+		}
+		return nil
+	})
+	
+	if removedCount > 0 {
+		log.Infof("Removed %d stale temp files", removedCount)
+	}
+	return err
+}
+
 // DeleteCachedFile deletes a specific cached file
 func DeleteCachedFile(path string) error {
 	cfg := config.Get()
@@ -385,23 +570,44 @@ func DeleteCachedFile(path string) error {
 		return fmt.Errorf("invalid path: outside storage directory")
 	}
 	
+	info, err := os.Lstat(absPath)
+	if err != nil {
+		return err
+	}
+	
 	// Also remove metadata file
 	metaPath := absPath + ".meta"
 	os.Remove(metaPath)
 	
-	return os.Remove(absPath)
+	if err := os.Remove(absPath); err != nil {
+		return err
+	}
+	if stats.IsCachedFile(info.Name()) {
+		stats.RecordFileRemove(absPath, info.Size())
+	}
+	return nil
 }
 
 // AddBlacklistPattern adds a pattern to the blacklist
 func AddBlacklistPattern(pattern string) error {
-	db := database.Get()
+	db := database.Writer()
 	_, err := db.Exec("INSERT OR IGNORE INTO package_blacklist (pattern) VALUES (?)", pattern)
 	if err != nil {
 		return err
 	}
 	
 	blacklistMu.Lock()
-	blacklistPatterns = append(blacklistPatterns, pattern)
+	exists := false
+	for _, p := range blacklistPatterns {
+		if p == pattern {
+			exists = true
+			break
+		}
+	}
+	if !exists {
+		blacklistPatterns = append(blacklistPatterns, pattern)
+		rebuildBlacklist()
+	}
 	blacklistMu.Unlock()
 	
 	log := logger.Get()
@@ -411,7 +617,7 @@ func AddBlacklistPattern(pattern string) error {
 
 // RemoveBlacklistPattern removes a pattern from the blacklist
 func RemoveBlacklistPattern(pattern string) error {
-	db := database.Get()
+	db := database.Writer()
 	_, err := db.Exec("DELETE FROM package_blacklist WHERE pattern = ?", pattern)
 	if err != nil {
 		return err
@@ -424,6 +630,7 @@ func RemoveBlacklistPattern(pattern string) error {
 			break
 		}
 	}
+	rebuildBlacklist()
 	blacklistMu.Unlock()
 	
 	log := logger.Get()
@@ -2,9 +2,12 @@ package config
 
 import (
 	"encoding/json"
+	"errors"
 	"os"
 	"path/filepath"
 	"sync"
+	"sync/atomic"
+	"syscall"
 )
 
 type Config struct {
@@ -25,9 +28,9 @@ type Config struct {
 }
 
 var (
-	cfg  *Config
-	mu   sync.RWMutex
-	once sync.Once
+	current atomic.Value // *Config, replaced as a whole on every change
+	mu      sync.Mutex   // serializes Reload and Set
+	once    sync.Once
 )
 
 // Load loads configuration from config.json
@@ -109,14 +112,15 @@ func reload() error {
 		return err
 	}
 
-	cfg = &newCfg
+	current.Store(&newCfg)
 	return nil
 }
 
-// Get returns the current configuration
+// Get returns the current configuration. It is called on every request,
+// so it takes no lock; the returned Config is shared and must be treated
+// as read-only.
 func Get() *Config {
-	mu.RLock()
-	defer mu.RUnlock()
+	cfg, _ := current.Load().(*Config)
 	return cfg
 }
 
@@ -125,6 +129,9 @@ func Set(key string, value interface{}) error {
 	mu.Lock()
 	defer mu.Unlock()
 
+	// Copy on write: readers may still hold the previous Config
+	cfg := *Get()
+
 	switch key {
 	case "cache_days":
 		if v, ok := value.(int); ok {
@@ -136,15 +143,61 @@ func Set(key string, value interface{}) error {
 		}
 	}
 
+	current.Store(&cfg)
+
 	// Save to disk
-	return saveConfig()
+	return saveConfig(&cfg)
 }
 
-func saveConfig() error {
+// saveConfig writes cfg to a synced temp file in the same directory and
+// renames it over config.json, so a crash leaves either the old or the new
+// config. The existing file's mode is kept, since it may guard admin_token.
+func saveConfig(cfg *Config) error {
 	configPath := filepath.Join(cfg.BaseDir, "config.json")
 	data, err := json.MarshalIndent(cfg, "", "  ")
 	if err != nil {
 		return err
 	}
-	return os.WriteFile(configPath, data, 0644)
+	
+	mode := os.FileMode(0644)
+	if info, err := os.Stat(configPath); err == nil {
+		mode = info.Mode().Perm()
+	}
+	
+	tmp, err := os.CreateTemp(cfg.BaseDir, "config.json.*.tmp")
+	if err != nil {
+		return err
+	}
+	tmpPath := tmp.Name()
+	
+	if err := writeSynced(tmp, data, mode); err != nil {
+		tmp.Close()
+		os.Remove(tmpPath)
+		return err
+	}
+	if err := tmp.Close(); err != nil {
+		os.Remove(tmpPath)
+		return err
+	}
+	
+	if err := os.Rename(tmpPath, configPath); err != nil {
+		os.Remove(tmpPath)
+		// config.json bind-mounted as a single file (the usual way to run
+		// the Docker image) can't be replaced; write it in place as before
+		if errors.Is(err, syscall.EBUSY) || errors.Is(err, syscall.EXDEV) {
+			return os.WriteFile(configPath, data, mode)
+		}
+		return err
+	}
+	return nil
+}
+
+func writeSynced(f *os.File, data []byte, mode os.FileMode) error {
+	if _, err := f.Write(data); err != nil {
+		return err
+	}
+	if err := f.Chmod(mode); err != nil {
+		return err
+	}
+	return f.Sync()
 }
@@ -2,35 +2,92 @@ package database
 
 import (
 	"database/sql"
+	"encoding/json"
+	"runtime"
 	"sync"
 
 	"apt-cache-proxy/internal/config"
 	"apt-cache-proxy/internal/logger"
 
-	_ "github.com/mattn/go-sqlite3"
+	"github.com/mattn/go-sqlite3"
 )
 
+const (
+	driverName = "sqlite3_tuned"
+	memoryPath = ":memory:"
+)
+
+// connPragmas are applied to every new connection in the pool. journal_mode
+// is persistent in the database file and is set once in Init instead.
+var connPragmas = []string{
+	"PRAGMA synchronous = NORMAL",
+	"PRAGMA temp_store = MEMORY",
+	"PRAGMA cache_size = -20000",
+	"PRAGMA foreign_keys = ON",
+}
+
 var (
-	db   *sql.DB
-	mu   sync.Mutex
-	once sync.Once
+	db     *sql.DB // single writer connection
+	readDB *sql.DB // pool of reader connections
+	once   sync.Once
 )
 
-// Init initializes the database connection
+func init() {
+	sql.Register(driverName, &sqlite3.SQLiteDriver{
+		ConnectHook: func(conn *sqlite3.SQLiteConn) error {
+			for _, pragma := range connPragmas {
+				if _, err := conn.Exec(pragma, nil); err != nil {
+					return err
+				}
+			}
+			return nil
+		},
+	})
+}
+
+// Init initializes the database connection pools
 func Init() error {
 	var err error
 	once.Do(func() {
 		cfg := config.Get()
 		log := logger.Get()
 
-		db, err = sql.Open("sqlite3", cfg.DatabasePathResolved+"?_journal_mode=WAL&_busy_timeout=5000")
+		// An in-memory database only exists on the connection that opened
+		// it, so readers and the writer share a single connection and no WAL.
+		memory := cfg.DatabasePath == memoryPath
+		path := cfg.DatabasePathResolved
+		if memory {
+			path = memoryPath
+		}
+
+		// _txlock=immediate makes every Begin() take the write lock up front,
+		// so concurrent writers wait on busy_timeout instead of failing with
+		// SQLITE_BUSY when upgrading a read transaction.
+		db, err = sql.Open(driverName, path+"?_busy_timeout=5000&_txlock=immediate")
 		if err != nil {
 			return
 		}
 
-		// Set connection pool settings for better concurrency
-		db.SetMaxOpenConns(25)
-		db.SetMaxIdleConns(10)
+		// SQLite serializes writes anyway; one connection queues them in
+		// the pool instead of in busy_timeout retries.
+		db.SetMaxOpenConns(1)
+
+		if memory {
+			readDB = db
+		} else {
+			// WAL lets readers proceed while the stats writer commits
+			if _, err = db.Exec("PRAGMA journal_mode = WAL"); err != nil {
+				return
+			}
+
+			readDB, err = sql.Open(driverName, path+"?_busy_timeout=5000")
+			if err != nil {
+				return
+			}
+			readers := runtime.NumCPU()
+			readDB.SetMaxOpenConns(readers)
+			readDB.SetMaxIdleConns(readers)
+		}
 
 		// Create tables
 		err = createTables()
@@ -43,13 +100,21 @@ func Init() error {
 	return err
 }
 
-// Get returns the database connection
-func Get() *sql.DB {
+// Reader returns the connection pool for queries
+func Reader() *sql.DB {
+	return readDB
+}
+
+// Writer returns the connection used for inserts, updates and deletes
+func Writer() *sql.DB {
 	return db
 }
 
-// Close closes the database connection
+// Close closes the database connections
 func Close() error {
+	if readDB != nil && readDB != db {
+		readDB.Close()
+	}
 	if db != nil {
 		return db.Close()
 	}
@@ -75,27 +140,44 @@ func createTables() error {
 	);
 	`
 
-	_, err := db.Exec(schema)
+	// Schema, default stats and seed mirrors go in one transaction so a
+	// fresh database costs a single commit
+	tx, err := db.Begin()
+	if err != nil {
+		return err
+	}
+	defer tx.Rollback()
+
+	_, err = tx.Exec(schema)
 	if err != nil {
 		return err
 	}
 
 	// Initialize default stats
+	stmt, err := tx.Prepare("INSERT OR IGNORE INTO stats (key, value) VALUES (?, 0)")
+	if err != nil {
+		return err
+	}
+	defer stmt.Close()
+
 	statsKeys := []string{"requests_total", "cache_hits", "cache_misses", "bytes_served"}
 	for _, key := range statsKeys {
-		_, err := db.Exec("INSERT OR IGNORE INTO stats (key, value) VALUES (?, 0)", key)
-		if err != nil {
+		if _, err := stmt.Exec(key); err != nil {
 			return err
 		}
 	}
 
-	return seedDefaultMirrors()
+	if err := seedDefaultMirrors(tx); err != nil {
+		return err
+	}
+
+	return tx.Commit()
 }
 
-func seedDefaultMirrors() error {
+func seedDefaultMirrors(tx *sql.Tx) error {
 	// Check if mirrors table is empty
 	var count int
-	err := db.QueryRow("SELECT COUNT(*) FROM mirrors").Scan(&count)
+	err := tx.QueryRow("SELECT COUNT(*) FROM mirrors").Scan(&count)
 	if err != nil {
 		return err
 	}
@@ -186,16 +268,19 @@ func seedDefaultMirrors() error {
 		},
 	}
 
+	stmt, err := tx.Prepare("INSERT INTO mirrors (name, urls, status) VALUES (?, ?, ?)")
+	if err != nil {
+		return err
+	}
+	defer stmt.Close()
+
 	for name, urls := range defaultMirrors {
-		urlsJSON := `["` + urls[0]
-		for i := 1; i < len(urls); i++ {
-			urlsJSON += `","` + urls[i]
+		urlsJSON, err := json.Marshal(urls)
+		if err != nil {
+			return err
 		}
-		urlsJSON += `"]`
 
-		_, err := db.Exec("INSERT INTO mirrors (name, urls, status) VALUES (?, ?, ?)",
-			name, urlsJSON, "approved")
-		if err != nil {
+		if _, err := stmt.Exec(name, string(urlsJSON), "approved"); err != nil {
 			return err
 		}
 	}
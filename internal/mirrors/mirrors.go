@@ -6,6 +6,7 @@ import (
 	"net/http"
 	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	"apt-cache-proxy/internal/database"
@@ -17,30 +18,100 @@ type Mirror struct {
 	Status string   `json:"status"`
 }
 
+// snapshot is a read-only view of the mirror table. Writers build a new
+// one and swap it in, so request handlers read mirrors without locking.
+type snapshot struct {
+	all      map[string]Mirror
+	approved map[string][]string
+	bases    map[string][]string // approved URLs without trailing slash
+}
+
 var (
-	mirrorsCache map[string]Mirror
-	mu           sync.RWMutex
+	current atomic.Value // *snapshot
+	mu      sync.Mutex   // serializes writers
+)
+
+const (
+	resolveTTL         = 10 * time.Minute
+	resolveNegativeTTL = 1 * time.Minute
+	maxResolveEntries  = 1024
+	localIPsTTL        = 5 * time.Minute
+)
+
+const maxValidateWorkers = 8
+
+// validateClient is shared so probes to the same host reuse connections
+var validateClient = &http.Client{
+	Timeout: 5 * time.Second,
+}
+
+type resolveEntry struct {
+	ips     []net.IP
+	expires time.Time
+}
+
+var (
+	resolveCache = make(map[string]resolveEntry)
+	resolveMu    sync.Mutex
+
+	localIPs        map[string]struct{}
+	localIPsExpires time.Time
+	localIPsMu      sync.Mutex
 )
 
 func init() {
-	mirrorsCache = make(map[string]Mirror)
+	current.Store(newSnapshot(make(map[string]Mirror)))
+}
+
+func newSnapshot(all map[string]Mirror) *snapshot {
+	approved := make(map[string][]string, len(all))
+	bases := make(map[string][]string, len(all))
+	for name, mirror := range all {
+		if mirror.Status == "approved" {
+			approved[name] = mirror.URLs
+			
+			trimmed := make([]string, len(mirror.URLs))
+			for i, u := range mirror.URLs {
+				trimmed[i] = strings.TrimSuffix(u, "/")
+			}
+			bases[name] = trimmed
+		}
+	}
+	return &snapshot{all: all, approved: approved, bases: bases}
+}
+
+func load() *snapshot {
+	return current.Load().(*snapshot)
+}
+
+// update publishes a modified copy of the mirror table; callers must hold mu
+func update(change func(all map[string]Mirror)) {
+	old := load().all
+	all := make(map[string]Mirror, len(old)+1)
+	for name, mirror := range old {
+		all[name] = mirror
+	}
+	change(all)
+	current.Store(newSnapshot(all))
 }
 
 // LoadFromDB loads mirrors from database
 func LoadFromDB() error {
-	db := database.Get()
+	db := database.Reader()
 	log := logger.Get()
 	
+	// Hold off other writers so a save can't land between our read and
+	// the swap; readers keep using the previous snapshot meanwhile
+	mu.Lock()
+	defer mu.Unlock()
+	
 	rows, err := db.Query("SELECT name, urls, status FROM mirrors")
 	if err != nil {
 		return err
 	}
 	defer rows.Close()
 	
-	mu.Lock()
-	defer mu.Unlock()
-	
-	mirrorsCache = make(map[string]Mirror)
+	all := make(map[string]Mirror)
 	
 	for rows.Next() {
 		var name, urlsJSON, status string
@@ -53,37 +124,36 @@ func LoadFromDB() error {
 			continue
 		}
 		
-		mirrorsCache[name] = Mirror{
+		all[name] = Mirror{
 			URLs:   urls,
 			Status: status,
 		}
 	}
+	current.Store(newSnapshot(all))
 	
-	log.Infof("Loaded %d mirrors from database", len(mirrorsCache))
+	log.Infof("Loaded %d mirrors from database", len(all))
 	return nil
 }
 
-// GetAll returns all approved mirrors
+// GetAll returns all approved mirrors. The map is shared and replaced on
+// every change rather than modified, so callers must not mutate it.
 func GetAll() map[string][]string {
-	mu.RLock()
-	defer mu.RUnlock()
-	
-	result := make(map[string][]string)
-	for name, mirror := range mirrorsCache {
-		if mirror.Status == "approved" {
-			result[name] = mirror.URLs
-		}
-	}
-	return result
+	return load().approved
+}
+
+// GetBaseURLs returns the approved mirrors like GetAll, with any trailing
+// slash already removed so a package URL is base + "/" + path. The map is
+// shared in the same way and must not be mutated.
+func GetBaseURLs() map[string][]string {
+	return load().bases
 }
 
 // GetAllWithStatus returns all mirrors with their status (for admin)
 func GetAllWithStatus() map[string]Mirror {
-	mu.RLock()
-	defer mu.RUnlock()
+	all := load().all
 	
-	result := make(map[string]Mirror)
-	for name, mirror := range mirrorsCache {
+	result := make(map[string]Mirror, len(all))
+	for name, mirror := range all {
 		result[name] = mirror
 	}
 	return result
@@ -116,12 +186,7 @@ func Save(name string, urls []string, status string) error {
 	}
 	
 	// Validate URLs
-	validURLs := []string{}
-	for _, url := range urls {
-		if validateMirror(url) {
-			validURLs = append(validURLs, url)
-		}
-	}
+	validURLs := validateMirrors(urls)
 	
 	if len(validURLs) == 0 {
 		return nil
@@ -132,7 +197,7 @@ func Save(name string, urls []string, status string) error {
 		return err
 	}
 	
-	db := database.Get()
+	db := database.Writer()
 	_, err = db.Exec("INSERT OR REPLACE INTO mirrors (name, urls, status) VALUES (?, ?, ?)",
 		name, string(urlsJSON), status)
 	if err != nil {
@@ -141,10 +206,12 @@ func Save(name string, urls []string, status string) error {
 	
 	// Update cache
 	mu.Lock()
-	mirrorsCache[name] = Mirror{
-		URLs:   validURLs,
-		Status: status,
-	}
+	update(func(all map[string]Mirror) {
+		all[name] = Mirror{
+			URLs:   validURLs,
+			Status: status,
+		}
+	})
 	mu.Unlock()
 	
 	log := logger.Get()
@@ -154,7 +221,7 @@ func Save(name string, urls []string, status string) error {
 
 // Update updates a mirror's URLs or status
 func Update(name string, urls []string, status string) error {
-	db := database.Get()
+	db := database.Writer()
 	
 	if urls != nil {
 		urlsJSON, err := json.Marshal(urls)
@@ -180,14 +247,16 @@ func Update(name string, urls []string, status string) error {
 
 // Delete deletes a mirror
 func Delete(name string) error {
-	db := database.Get()
+	db := database.Writer()
 	_, err := db.Exec("DELETE FROM mirrors WHERE name = ?", name)
 	if err != nil {
 		return err
 	}
 	
 	mu.Lock()
-	delete(mirrorsCache, name)
+	update(func(all map[string]Mirror) {
+		delete(all, name)
+	})
 	mu.Unlock()
 	
 	log := logger.Get()
@@ -203,8 +272,8 @@ func isSelf(host string) bool {
 	}
 	
 	// Check if it resolves to a local IP
-	ips, err := net.LookupIP(hostname)
-	if err != nil {
+	ips := lookupIP(hostname)
+	if len(ips) == 0 {
 		return false
 	}
 	
@@ -212,18 +281,58 @@ func isSelf(host string) bool {
 	localIPs := getLocalIPs()
 	
 	for _, ip := range ips {
-		for _, localIP := range localIPs {
-			if ip.Equal(localIP) {
-				return true
-			}
+		if _, ok := localIPs[ip.String()]; ok {
+			return true
 		}
 	}
 	
 	return false
 }
 
-func getLocalIPs() []net.IP {
-	var ips []net.IP
+// lookupIP resolves a hostname, caching answers (and failures, for a
+// shorter time) so repeated mirror saves don't block on DNS
+func lookupIP(hostname string) []net.IP {
+	now := time.Now()
+	
+	resolveMu.Lock()
+	entry, ok := resolveCache[hostname]
+	resolveMu.Unlock()
+	if ok && now.Before(entry.expires) {
+		return entry.ips
+	}
+	
+	ips, err := net.LookupIP(hostname)
+	ttl := resolveTTL
+	if err != nil {
+		ips = nil
+		ttl = resolveNegativeTTL
+	}
+	
+	resolveMu.Lock()
+	if len(resolveCache) >= maxResolveEntries {
+		for name, e := range resolveCache {
+			if now.After(e.expires) {
+				delete(resolveCache, name)
+			}
+		}
+	}
+	resolveCache[hostname] = resolveEntry{ips: ips, expires: now.Add(ttl)}
+	resolveMu.Unlock()
+	
+	return ips
+}
+
+// getLocalIPs returns the interface addresses of this host, refreshed at
+// most every localIPsTTL
+func getLocalIPs() map[string]struct{} {
+	localIPsMu.Lock()
+	defer localIPsMu.Unlock()
+	
+	if localIPs != nil && time.Now().Before(localIPsExpires) {
+		return localIPs
+	}
+	
+	ips := make(map[string]struct{})
 	
 	addrs, err := net.InterfaceAddrs()
 	if err != nil {
@@ -232,19 +341,44 @@ func getLocalIPs() []net.IP {
 	
 	for _, addr := range addrs {
 		if ipnet, ok := addr.(*net.IPNet); ok {
-			ips = append(ips, ipnet.IP)
+			ips[ipnet.IP.String()] = struct{}{}
 		}
 	}
 	
+	localIPs = ips
+	localIPsExpires = time.Now().Add(localIPsTTL)
 	return ips
 }
 
-func validateMirror(url string) bool {
-	client := &http.Client{
-		Timeout: 5 * time.Second,
+// validateMirrors probes all URLs concurrently and returns the reachable
+// ones in their original order
+func validateMirrors(urls []string) []string {
+	ok := make([]bool, len(urls))
+	sem := make(chan struct{}, maxValidateWorkers)
+	var wg sync.WaitGroup
+	
+	for i, url := range urls {
+		wg.Add(1)
+		sem <- struct{}{}
+		go func(i int, url string) {
+			defer wg.Done()
+			defer func() { <-sem }()
+			ok[i] = validateMirror(url)
+		}(i, url)
 	}
+	wg.Wait()
 	
-	resp, err := client.Head(url)
+	validURLs := []string{}
+	for i, url := range urls {
+		if ok[i] {
+			validURLs = append(validURLs, url)
+		}
+	}
+	return validURLs
+}
+
+func validateMirror(url string) bool {
+	resp, err := validateClient.Head(url)
 	if err != nil {
 		return false
 	}
@@ -3,10 +3,13 @@ package proxy
 import (
 	"fmt"
 	"io"
+	"mime"
 	"net"
 	"net/http"
 	"os"
+	"path/filepath"
 	"strings"
+	"sync"
 	"time"
 
 	"apt-cache-proxy/internal/cache"
@@ -16,6 +19,73 @@ import (
 	"apt-cache-proxy/internal/stats"
 )
 
+// copyBufSize is the chunk size used when streaming upstream bodies
+const copyBufSize = 128 * 1024
+
+var copyBufPool = sync.Pool{
+	New: func() interface{} {
+		buf := make([]byte, copyBufSize)
+		return &buf
+	},
+}
+
+// writerOnly hides ReadFrom so io.CopyBuffer uses our pooled buffer instead
+// of the ResponseWriter's internal 32KB one
+type writerOnly struct {
+	io.Writer
+}
+
+// copyBody streams src to w through a pooled buffer
+func copyBody(w io.Writer, src io.Reader) (int64, error) {
+	bufp := copyBufPool.Get().(*[]byte)
+	defer copyBufPool.Put(bufp)
+	return io.CopyBuffer(writerOnly{w}, src, *bufp)
+}
+
+// skipRequestHeaders are not forwarded upstream: Host is set by the client
+// and the rest are hop-by-hop (RFC 7230 section 6.1). Keys are canonical,
+// matching the keys net/http stores in r.Header.
+var skipRequestHeaders = map[string]struct{}{
+	"Host":                {},
+	"Connection":          {},
+	"Keep-Alive":          {},
+	"Proxy-Authenticate":  {},
+	"Proxy-Authorization": {},
+	"Proxy-Connection":    {},
+	"Te":                  {},
+	"Trailer":             {},
+	"Transfer-Encoding":   {},
+	"Upgrade":             {},
+}
+
+// skipResponseHeaders are not copied from passthrough responses. Keys are
+// canonical, matching the keys net/http stores in resp.Header.
+var skipResponseHeaders = map[string]struct{}{
+	"Content-Encoding":  {},
+	"Content-Length":    {},
+	"Transfer-Encoding": {},
+	"Connection":        {},
+}
+
+var connectEstablished = []byte("HTTP/1.1 200 Connection Established\r\n\r\n")
+
+// passthroughClient is shared by all direct proxy requests so upstream
+// connections are kept alive and reused instead of redialed per request
+var passthroughClient = &http.Client{
+	Transport: newPassthroughTransport(),
+	Timeout:   60 * time.Second,
+	CheckRedirect: func(req *http.Request, via []*http.Request) error {
+		return nil
+	},
+}
+
+func newPassthroughTransport() *http.Transport {
+	t := http.DefaultTransport.(*http.Transport).Clone()
+	t.MaxIdleConns = 128
+	t.MaxIdleConnsPerHost = 32
+	return t
+}
+
 type Handler struct{}
 
 func NewHandler() *Handler {
@@ -32,34 +102,31 @@ func (h *Handler) HandleAll(w http.ResponseWriter, r *http.Request) {
 
 	path := strings.TrimPrefix(r.URL.Path, "/")
 	
-	// Clean up proxy-style URLs
+	// Clean up proxy-style URLs by dropping scheme and host
 	if strings.HasPrefix(path, "http://") || strings.HasPrefix(path, "https://") {
-		parts := strings.SplitN(path, "/", 4)
-		if len(parts) >= 4 {
-			path = parts[3]
+		_, rest, _ := strings.Cut(path, "://")
+		if _, p, ok := strings.Cut(rest, "/"); ok {
+			path = p
 		}
 	}
 
-	parts := strings.SplitN(path, "/", 2)
-	if len(parts) < 2 {
+	distro, pkgPath, ok := strings.Cut(path, "/")
+	if !ok {
 		h.handleUnknown(w, r, path)
 		return
 	}
 
-	distro := parts[0]
-	pkgPath := parts[1]
-
 	// Check if this is a managed distro
 	upstreamKey := mirrors.GetUpstreamKey(distro, pkgPath)
-	allMirrors := mirrors.GetAll()
+	allMirrors := mirrors.GetBaseURLs()
 
-	if _, ok := allMirrors[upstreamKey]; ok {
-		h.handlePackage(w, r, distro, pkgPath)
-		return
+	mirrorURLs, ok := allMirrors[upstreamKey]
+	if !ok {
+		// Fallback to distro itself
+		mirrorURLs, ok = allMirrors[distro]
 	}
-
-	if _, ok := allMirrors[distro]; ok {
-		h.handlePackage(w, r, distro, pkgPath)
+	if ok {
+		h.handlePackage(w, r, distro, pkgPath, upstreamKey, mirrorURLs)
 		return
 	}
 
@@ -67,7 +134,7 @@ func (h *Handler) HandleAll(w http.ResponseWriter, r *http.Request) {
 	h.handleUnknown(w, r, path)
 }
 
-func (h *Handler) handlePackage(w http.ResponseWriter, r *http.Request, distro, pkgPath string) {
+func (h *Handler) handlePackage(w http.ResponseWriter, r *http.Request, distro, pkgPath, upstreamKey string, mirrorURLs []string) {
 	stats.IncrementRequests()
 	
 	log := logger.Get()
@@ -76,43 +143,30 @@ func (h *Handler) handlePackage(w http.ResponseWriter, r *http.Request, distro,
 
 	// Check cache
 	cachePath := cache.GetCachePath(distro, pkgPath)
-	if cache.IsCacheValid(cachePath) {
+	if file, info, ok := cache.OpenValidCache(cachePath); ok {
+		defer file.Close()
 		stats.IncrementCacheHits()
-		h.serveFromCache(w, r, cachePath)
+		h.serveFromCache(w, r, cachePath, file, info)
 		return
 	}
 
 	// Cache miss - download from upstream
 	stats.IncrementCacheMisses()
-	
-	upstreamKey := mirrors.GetUpstreamKey(distro, pkgPath)
-	allMirrors := mirrors.GetAll()
-	
-	mirrorURLs, ok := allMirrors[upstreamKey]
-	if !ok {
-		// Fallback to distro itself
-		mirrorURLs, ok = allMirrors[distro]
-		if !ok {
-			log.Warnf("No upstream configured for: %s", upstreamKey)
-			http.Error(w, "Unsupported distro", http.StatusNotFound)
-			return
-		}
-	}
 
 	// Build full URLs
 	upstreamURLs := make([]string, len(mirrorURLs))
-	for i, mirror := range mirrorURLs {
-		upstreamURLs[i] = fmt.Sprintf("%s/%s", strings.TrimSuffix(mirror, "/"), pkgPath)
+	for i, base := range mirrorURLs {
+		upstreamURLs[i] = base + "/" + pkgPath
 	}
 
 	log.Infof("MISS: %s -> %s", pkgPath, upstreamKey)
 	stats.AddLog(fmt.Sprintf("MISS: %s -> %s", pkgPath, upstreamKey), "INFO")
 
-	// Copy request headers
-	headers := make(map[string]string)
+	// Copy end-to-end request headers once; every mirror attempt shares them
+	headers := make(http.Header, len(r.Header))
 	for k, v := range r.Header {
-		if strings.ToLower(k) != "host" && len(v) > 0 {
-			headers[k] = v[0]
+		if _, skip := skipRequestHeaders[k]; !skip {
+			headers[k] = v
 		}
 	}
 
@@ -132,50 +186,49 @@ func (h *Handler) handlePackage(w http.ResponseWriter, r *http.Request, distro,
 	defer resp.Body.Close()
 
 	// Copy response headers
+	dst := w.Header()
 	for k, v := range resp.Header {
-		for _, val := range v {
-			w.Header().Add(k, val)
-		}
+		dst[k] = v
 	}
 
 	w.WriteHeader(resp.StatusCode)
 	
 	// Stream response to client (this also writes to cache via TeeReader)
-	written, err := io.Copy(w, resp.Body)
+	written, err := copyBody(w, resp.Body)
+	
+	// One atomic add per response, including partial transfers
+	stats.AddBytesServed(written)
+	
 	if err != nil {
 		// Only log if it's not a broken pipe (client disconnected)
 		if !strings.Contains(err.Error(), "broken pipe") && 
 		   !strings.Contains(err.Error(), "connection reset") {
 			log.Warnf("Error streaming response: %v", err)
 		}
-		return
 	}
-	
-	stats.AddBytesServed(written)
 }
 
-func (h *Handler) serveFromCache(w http.ResponseWriter, r *http.Request, cachePath string) {
+// serveFromCache serves a file opened by OpenValidCache; info is the
+// opened file's own stat, so the validators always match the body
+func (h *Handler) serveFromCache(w http.ResponseWriter, r *http.Request, cachePath string, file *os.File, info os.FileInfo) {
 	log := logger.Get()
 	log.Infof("Serving from cache: %s", cachePath)
 	stats.AddLog(fmt.Sprintf("HIT: %s", cachePath), "SUCCESS")
 
-	file, err := os.Open(cachePath)
-	if err != nil {
-		log.Errorf("Error reading cache: %v", err)
-		http.Error(w, "Error reading cache", http.StatusInternalServerError)
-		return
-	}
-	defer file.Close()
-
-	info, err := file.Stat()
-	if err != nil {
-		log.Errorf("Error stating cache file: %v", err)
-		http.Error(w, "Error reading cache", http.StatusInternalServerError)
-		return
+	// ServeContent sniffs the type of files with unknown extensions by
+	// reading 512 bytes and seeking back; setting it here saves that read
+	// and seek per hit. Extensionless files such as Release, InRelease and
+	// by-hash entries go out as application/octet-stream instead of the
+	// sniffed text/plain, which apt does not look at.
+	contentType := mime.TypeByExtension(filepath.Ext(info.Name()))
+	if contentType == "" {
+		contentType = "application/octet-stream"
 	}
+	w.Header().Set("Content-Type", contentType)
 
-	// Update access time
-	os.Chtimes(cachePath, time.Now(), info.ModTime())
+	// ServeContent answers If-None-Match and If-Range from this validator,
+	// and copies the body with sendfile(2) when no range is requested
+	w.Header().Set("ETag", fmt.Sprintf(`"%x-%x"`, info.ModTime().UnixNano(), info.Size()))
 
 	// Serve file
 	http.ServeContent(w, r, info.Name(), info.ModTime(), file)
@@ -203,29 +256,20 @@ func (h *Handler) handleUnknown(w http.ResponseWriter, r *http.Request, path str
 	log.Infof("Direct proxying: %s", targetURL)
 	stats.AddLog(fmt.Sprintf("PROXY: %s", targetURL), "INFO")
 
-	client := &http.Client{
-		Timeout: 60 * time.Second,
-		CheckRedirect: func(req *http.Request, via []*http.Request) error {
-			return nil
-		},
-	}
-
 	proxyReq, err := http.NewRequest(r.Method, targetURL, r.Body)
 	if err != nil {
 		http.Error(w, err.Error(), http.StatusInternalServerError)
 		return
 	}
 
-	// Copy headers
+	// Copy end-to-end headers
 	for k, v := range r.Header {
-		if strings.ToLower(k) != "host" {
-			for _, val := range v {
-				proxyReq.Header.Add(k, val)
-			}
+		if _, skip := skipRequestHeaders[k]; !skip {
+			proxyReq.Header[k] = v
 		}
 	}
 
-	resp, err := client.Do(proxyReq)
+	resp, err := passthroughClient.Do(proxyReq)
 	if err != nil {
 		log.Errorf("Proxy error: %v", err)
 		http.Error(w, err.Error(), http.StatusBadGateway)
@@ -233,18 +277,17 @@ func (h *Handler) handleUnknown(w http.ResponseWriter, r *http.Request, path str
 	}
 	defer resp.Body.Close()
 
-	// Copy response headers
+	// Copy response headers. The upstream response is discarded afterwards,
+	// so its value slices can be handed over without copying.
+	dst := w.Header()
 	for k, v := range resp.Header {
-		kl := strings.ToLower(k)
-		if kl != "content-encoding" && kl != "content-length" && kl != "transfer-encoding" && kl != "connection" {
-			for _, val := range v {
-				w.Header().Add(k, val)
-			}
+		if _, skip := skipResponseHeaders[k]; !skip {
+			dst[k] = v
 		}
 	}
 
 	w.WriteHeader(resp.StatusCode)
-	written, _ := io.Copy(w, resp.Body)
+	written, _ := copyBody(w, resp.Body)
 	stats.AddBytesServed(written)
 }
 
@@ -280,7 +323,7 @@ func (h *Handler) handleConnect(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
-	clientConn, _, err := hijacker.Hijack()
+	clientConn, bufrw, err := hijacker.Hijack()
 	if err != nil {
 		log.Errorf("Hijack failed: %v", err)
 		http.Error(w, err.Error(), http.StatusInternalServerError)
@@ -288,21 +331,34 @@ func (h *Handler) handleConnect(w http.ResponseWriter, r *http.Request) {
 	}
 	defer clientConn.Close()
 
+	// Hijacked connections may keep deadlines from the server's header
+	// timeout; a tunnel can sit idle for as long as the client likes
+	clientConn.SetDeadline(time.Time{})
+
 	// Send 200 Connection Established
-	clientConn.Write([]byte("HTTP/1.1 200 Connection Established\r\n\r\n"))
+	clientConn.Write(connectEstablished)
 
-	// Bidirectional copy
-	done := make(chan struct{}, 2)
+	// Forward anything the client sent right after the CONNECT request
+	// (typically the TLS ClientHello) that the server already buffered
+	if n := bufrw.Reader.Buffered(); n > 0 {
+		buffered, _ := bufrw.Reader.Peek(n)
+		if _, err := upstreamConn.Write(buffered); err != nil {
+			return
+		}
+	}
 
+	// Bidirectional copy. Both ends are *net.TCPConn, so io.Copy uses
+	// splice(2) on Linux and the bytes never enter userspace; the runtime
+	// poller already waits on both sockets with epoll.
+	//
+	// The handler goroutine carries upstream -> client itself, so a tunnel
+	// costs one extra goroutine. Whichever direction ends first closes both
+	// connections, which unblocks the other copy.
 	go func() {
 		io.Copy(upstreamConn, clientConn)
-		done <- struct{}{}
-	}()
-
-	go func() {
-		io.Copy(clientConn, upstreamConn)
-		done <- struct{}{}
+		upstreamConn.Close()
+		clientConn.Close()
 	}()
 
-	<-done
+	io.Copy(clientConn, upstreamConn)
 }
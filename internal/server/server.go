@@ -1,13 +1,16 @@
 package server
 
 import (
+	"context"
 	_ "embed"
 	"encoding/json"
+	"errors"
 	"fmt"
+	"io/fs"
 	"net/http"
-	"os"
 	"path/filepath"
 	"strings"
+	"time"
 
 	"apt-cache-proxy/internal/cache"
 	"apt-cache-proxy/internal/config"
@@ -19,11 +22,26 @@ import (
 	"github.com/gorilla/mux"
 )
 
+const maxSearchResults = 100
+
+// errSearchLimit stops the storage walk once enough results are found
+var errSearchLimit = errors.New("search result limit reached")
+
+// searchSlots bounds concurrent cache searches. The endpoint is public (the
+// dashboard calls it without a token) and a query with few matches walks
+// the whole storage tree, so extra searches are turned away, not queued.
+// Requests with the admin token get their own slot so public users can't
+// lock the admin panel out.
+var (
+	searchSlots      = make(chan struct{}, 2)
+	adminSearchSlots = make(chan struct{}, 1)
+)
+
 //go:embed templates/dashboard.html
-var dashboardHTML string
+var dashboardHTML []byte
 
 //go:embed templates/admin.html
-var adminHTML string
+var adminHTML []byte
 
 // New creates a new HTTP server with all routes
 func New(proxyHandler *proxy.Handler) *http.Server {
@@ -31,6 +49,7 @@ func New(proxyHandler *proxy.Handler) *http.Server {
 
 	// Public routes (no auth)
 	r.HandleFunc("/health", healthHandler).Methods("GET")
+	r.HandleFunc("/favicon.ico", faviconHandler).Methods("GET").MatcherFunc(notProxyRequest)
 	r.HandleFunc("/api/stats", statsHandler).Methods("GET")
 	r.HandleFunc("/api/cache/search", cacheSearchHandler).Methods("GET")
 	r.HandleFunc("/acng-report.html", dashboardHandler).Methods("GET")
@@ -60,9 +79,15 @@ func New(proxyHandler *proxy.Handler) *http.Server {
 	cfg := config.Get()
 	addr := fmt.Sprintf("%s:%d", cfg.Host, cfg.Port)
 
+	// No ReadTimeout/WriteTimeout: cache misses and CONNECT tunnels stream
+	// for as long as the download takes. Bound only header reads and idle
+	// keep-alive connections so slow or abandoned clients don't pile up.
 	return &http.Server{
-		Addr:    addr,
-		Handler: r,
+		Addr:              addr,
+		Handler:           r,
+		ReadHeaderTimeout: 10 * time.Second,
+		IdleTimeout:       120 * time.Second,
+		MaxHeaderBytes:    64 << 10,
 	}
 }
 
@@ -76,18 +101,7 @@ func authMiddleware(next http.Handler) http.Handler {
 			return
 		}
 
-		authHeader := r.Header.Get("Authorization")
-		if authHeader == "" {
-			http.Error(w, "Unauthorized", http.StatusUnauthorized)
-			return
-		}
-
-		receivedToken := authHeader
-		if strings.HasPrefix(authHeader, "Bearer ") {
-			receivedToken = strings.TrimPrefix(authHeader, "Bearer ")
-		}
-
-		if receivedToken != token {
+		if !hasToken(r, token) {
 			http.Error(w, "Unauthorized", http.StatusUnauthorized)
 			return
 		}
@@ -96,6 +110,15 @@ func authMiddleware(next http.Handler) http.Handler {
 	})
 }
 
+// hasToken reports whether r carries token, bare or as a Bearer token
+func hasToken(r *http.Request, token string) bool {
+	authHeader := r.Header.Get("Authorization")
+	if authHeader == "" {
+		return false
+	}
+	return strings.TrimPrefix(authHeader, "Bearer ") == token
+}
+
 func healthHandler(w http.ResponseWriter, r *http.Request) {
 	cfg := config.Get()
 	json.NewEncoder(w).Encode(map[string]string{
@@ -122,12 +145,25 @@ func statsHandler(w http.ResponseWriter, r *http.Request) {
 
 func dashboardHandler(w http.ResponseWriter, r *http.Request) {
 	w.Header().Set("Content-Type", "text/html")
-	w.Write([]byte(dashboardHTML))
+	w.Write(dashboardHTML)
 }
 
 func adminHandler(w http.ResponseWriter, r *http.Request) {
 	w.Header().Set("Content-Type", "text/html")
-	w.Write([]byte(adminHTML))
+	w.Write(adminHTML)
+}
+
+// faviconHandler answers browser favicon requests without falling through
+// to the proxy handler, which would treat them as an unknown distro
+func faviconHandler(w http.ResponseWriter, r *http.Request) {
+	w.WriteHeader(http.StatusNoContent)
+}
+
+// notProxyRequest matches requests addressed to this server itself. mux
+// routes on the path alone, so an absolute-form proxy request such as
+// "GET http://host/favicon.ico" would otherwise be answered locally.
+func notProxyRequest(r *http.Request, _ *mux.RouteMatch) bool {
+	return !r.URL.IsAbs()
 }
 
 func getConfigHandler(w http.ResponseWriter, r *http.Request) {
@@ -281,7 +317,8 @@ func removeBlacklistHandler(w http.ResponseWriter, r *http.Request) {
 }
 
 func cleanupHandler(w http.ResponseWriter, r *http.Request) {
-	go cache.CleanOldCache()
+	// Not tied to the request: cleanup carries on after the reply
+	go cache.CleanOldCache(context.Background())
 	json.NewEncoder(w).Encode(map[string]string{"status": "cleanup started"})
 }
 
@@ -308,17 +345,49 @@ func cacheSearchHandler(w http.ResponseWriter, r *http.Request) {
 	}
 
 	cfg := config.Get()
-	var results []map[string]interface{}
+	slots := searchSlots
+	if cfg.AdminToken != "" && hasToken(r, cfg.AdminToken) {
+		slots = adminSearchSlots
+	}
+
+	select {
+	case slots <- struct{}{}:
+		defer func() { <-slots }()
+	default:
+		w.Header().Set("Content-Type", "application/json")
+		w.Header().Set("Retry-After", "5")
+		w.WriteHeader(http.StatusServiceUnavailable)
+		json.NewEncoder(w).Encode(map[string]string{"error": "Too many searches in progress, try again shortly"})
+		return
+	}
+
+	ctx := r.Context()
+	results := []map[string]interface{}{}
+	query = strings.ToLower(query)
 
 	// Simple file search implementation
-	// Walk through storage directory and find matching files
-	err := filepath.Walk(cfg.StoragePathResolved, func(path string, info os.FileInfo, err error) error {
-		if err != nil || info.IsDir() {
+	// Walk through storage directory and find matching files. Names are
+	// matched from the directory listing; only hits are stat'ed.
+	err := filepath.WalkDir(cfg.StoragePathResolved, func(path string, d fs.DirEntry, err error) error {
+		// Stop walking for a client that has gone away
+		if ctxErr := ctx.Err(); ctxErr != nil {
+			return ctxErr
+		}
+		if err != nil || d.IsDir() {
+			return nil
+		}
+
+		filename := d.Name()
+		if !stats.IsCachedFile(filename) {
 			return nil
 		}
 
-		filename := filepath.Base(path)
-		if strings.Contains(strings.ToLower(filename), strings.ToLower(query)) {
+		if strings.Contains(strings.ToLower(filename), query) {
+			info, err := d.Info()
+			if err != nil {
+				return nil
+			}
+
 			// Extract distro from path
 			relPath, _ := filepath.Rel(cfg.StoragePathResolved, path)
 			distro := strings.Split(relPath, string(filepath.Separator))[0]
@@ -329,19 +398,22 @@ func cacheSearchHandler(w http.ResponseWriter, r *http.Request) {
 				"size":   info.Size(),
 				"path":   path,
 				"mtime":  info.ModTime().Format("2006-01-02 15:04"),
-				"atime":  info.ModTime().Format("2006-01-02 15:04"),
+				"atime":  info.ModTime().Format("2006-01-02 15:04"), // hits aren't tracked; kept for API clients
 			})
 		}
 
 		// Limit results to 100
-		if len(results) >= 100 {
-			return filepath.SkipDir
+		if len(results) >= maxSearchResults {
+			return errSearchLimit
 		}
 
 		return nil
 	})
 
-	if err != nil {
+	if ctx.Err() != nil {
+		return
+	}
+	if err != nil && err != errSearchLimit {
 		http.Error(w, err.Error(), http.StatusInternalServerError)
 		return
 	}
@@ -1,8 +1,10 @@
 package stats
 
 import (
+	"context"
 	"os"
 	"path/filepath"
+	"strings"
 	"sync"
 	"sync/atomic"
 	"time"
@@ -12,12 +14,22 @@ import (
 	"apt-cache-proxy/internal/logger"
 )
 
-// Stats holds runtime statistics with atomic counters for thread-safety
+// cacheLinePad separates the counters in Stats onto their own cache lines
+const cacheLinePad = 64 - 8
+
+// Stats holds runtime statistics with atomic counters for thread-safety.
+// Every request bumps two or three different counters from different
+// cores; padding keeps those atomic adds from invalidating each other's
+// cache line.
 type Stats struct {
 	RequestsTotal uint64
+	_             [cacheLinePad]byte
 	CacheHits     uint64
+	_             [cacheLinePad]byte
 	CacheMisses   uint64
+	_             [cacheLinePad]byte
 	BytesServed   uint64
+	_             [cacheLinePad]byte
 	StartTime     time.Time
 }
 
@@ -25,9 +37,40 @@ type FileStats struct {
 	TotalFiles   int64
 	TotalSize    int64
 	DistroStats  map[string]DistroStat
+	ready        bool      // set once the first scan has finished
+	scan         *fileScan // running UpdateFileStats, nil otherwise
 	mu           sync.RWMutex
 }
 
+type dirState int
+
+const (
+	dirScheduled dirState = iota + 1 // found by its parent's listing, not read yet
+	dirListing                       // being read; changes are journalled
+	dirCounted                       // read; changes apply to the result
+)
+
+// fileScan is the state of a running UpdateFileStats. A cache write or
+// removal is handled by where it lands relative to the walk: in a directory
+// still to be read it is left to the walk, which sees it on disk; in one
+// being read it is journalled and checked against what the listing counted;
+// in one already read, or one created where the walk has already passed,
+// it is added to the scan result. Guarded by fileStats.mu.
+type fileScan struct {
+	ctx     context.Context // stops the walk on shutdown
+	dirs    map[string]dirState
+	journal map[string][]fileChange // changes below each directory being read
+	distros map[string]DistroStat   // changes carried into the result
+}
+
+// fileChange is one RecordFileAdd or RecordFileRemove seen during a scan
+type fileChange struct {
+	path   string
+	distro string
+	files  int64
+	size   int64
+}
+
 type DistroStat struct {
 	Files int64 `json:"files"`
 	Size  int64 `json:"size"`
@@ -39,12 +82,19 @@ type LogEntry struct {
 	Message string `json:"message"`
 }
 
+const maxLogSize = 100
+
 var (
-	stats      Stats
-	fileStats  FileStats
-	logBuffer  []LogEntry
-	logMu      sync.Mutex
-	maxLogSize = 100
+	stats     Stats
+	fileStats FileStats
+	logBuffer [maxLogSize]LogEntry // ring buffer, logNext is the oldest once full
+	logNext   int
+	logCount  int
+	logMu     sync.Mutex
+	scanMu    sync.Mutex // one UpdateFileStats at a time
+
+	lastSaved   map[string]uint64 // values written by the last SaveToDB
+	lastSavedMu sync.Mutex
 )
 
 func init() {
@@ -90,29 +140,104 @@ func GetFileStats() map[string]interface{} {
 	fileStats.mu.RLock()
 	defer fileStats.mu.RUnlock()
 	
+	// Copy: RecordFileAdd/Remove update the map in place
+	distroStats := make(map[string]DistroStat, len(fileStats.DistroStats))
+	for distro, ds := range fileStats.DistroStats {
+		distroStats[distro] = ds
+	}
+	
 	return map[string]interface{}{
 		"total_files":           fileStats.TotalFiles,
 		"total_size":            fileStats.TotalSize,
 		"total_cache_size_mb":   float64(fileStats.TotalSize) / (1024 * 1024),
-		"distro_stats":          fileStats.DistroStats,
+		"distro_stats":          distroStats,
+	}
+}
+
+// IsCachedFile reports whether a storage file name is a cached package,
+// as opposed to a ".meta" sidecar or an in-progress ".tmp" download
+func IsCachedFile(name string) bool {
+	return !strings.HasSuffix(name, ".meta") && !strings.HasSuffix(name, ".tmp")
+}
+
+// RecordFileAdd counts a newly cached file without rescanning storage
+func RecordFileAdd(path string, size int64) {
+	adjustFileStats(config.Get().StoragePathResolved, path, 1, size)
+}
+
+// RecordFileRemove uncounts a file removed from the cache
+func RecordFileRemove(path string, size int64) {
+	adjustFileStats(config.Get().StoragePathResolved, path, -1, -size)
+}
+
+func adjustFileStats(root, path string, files, size int64) {
+	distro := distroOf(root, path)
+	
+	fileStats.mu.Lock()
+	defer fileStats.mu.Unlock()
+	
+	// Until the first scan finishes the counters start from zero, so
+	// removals would push them negative; the scan result replaces them
+	if fileStats.ready {
+		fileStats.TotalFiles += files
+		fileStats.TotalSize += size
+		addDistroStat(fileStats.DistroStats, distro, files, size)
+	}
+	
+	if scan := fileStats.scan; scan != nil {
+		scan.record(fileChange{path: path, distro: distro, files: files, size: size})
+	}
+}
+
+func addDistroStat(m map[string]DistroStat, distro string, files, size int64) {
+	ds := m[distro]
+	ds.Files += files
+	ds.Size += size
+	m[distro] = ds
+}
+
+// distroOf returns the top-level storage directory a cache path belongs to
+func distroOf(root, path string) string {
+	rel, err := filepath.Rel(root, path)
+	if err != nil {
+		return ""
 	}
+	distro, _, _ := strings.Cut(rel, string(filepath.Separator))
+	return distro
 }
 
-// UpdateFileStats recalculates file statistics (expensive operation)
-func UpdateFileStats() error {
+// UpdateFileStats recalculates file statistics by scanning storage. This is
+// expensive, so it only runs at startup and as a periodic reconciliation;
+// cache writes and removals keep the counters current in between, and
+// those made while the scan runs are carried over into its result.
+func UpdateFileStats(ctx context.Context) error {
+	scanMu.Lock()
+	defer scanMu.Unlock()
+	
 	cfg := config.Get()
 	log := logger.Get()
 	
 	log.Debug("Starting file stats update...")
 	
-	totalFiles := int64(0)
-	totalSize := int64(0)
-	distroStats := make(map[string]DistroStat)
+	totalFiles, totalSize, err := scanStorage(ctx, cfg.StoragePathResolved)
+	if err != nil {
+		return err
+	}
+	
+	log.Debugf("File stats updated: %d files, %.2f MB", totalFiles, float64(totalSize)/(1024*1024))
+	return nil
+}
+
+// scanStorage counts every distro directory below root and publishes the
+// result; callers must hold scanMu. A cancelled scan keeps the counters.
+func scanStorage(ctx context.Context, root string) (int64, int64, error) {
+	scan := beginScan(ctx)
 	
 	// Walk the storage directory
-	entries, err := os.ReadDir(cfg.StoragePathResolved)
+	_, _, distroDirs, err := scan.listDir(root)
 	if err != nil {
-		return err
+		endScan(scan, nil)
+		return 0, 0, err
 	}
 	
 	// Process each distro directory concurrently
@@ -122,32 +247,22 @@ func UpdateFileStats() error {
 		size   int64
 	}
 	
-	results := make(chan result, len(entries))
+	results := make(chan result, len(distroDirs))
 	var wg sync.WaitGroup
 	
-	for _, entry := range entries {
-		if !entry.IsDir() || entry.Name()[0] == '.' {
+	for _, dir := range distroDirs {
+		if filepath.Base(dir)[0] == '.' {
 			continue
 		}
 		
 		wg.Add(1)
-		go func(distroName string) {
+		go func(dir string) {
 			defer wg.Done()
 			
-			distroPath := filepath.Join(cfg.StoragePathResolved, distroName)
-			var dFiles, dSize int64
-			
-			filepath.Walk(distroPath, func(path string, info os.FileInfo, err error) error {
-				if err != nil || info.IsDir() {
-					return nil
-				}
-				dFiles++
-				dSize += info.Size()
-				return nil
-			})
-			
-			results <- result{distro: distroName, files: dFiles, size: dSize}
-		}(entry.Name())
+			r := result{distro: filepath.Base(dir)}
+			scan.countDir(dir, &r.files, &r.size)
+			results <- r
+		}(dir)
 	}
 	
 	// Close results channel when all goroutines finish
@@ -157,53 +272,214 @@ func UpdateFileStats() error {
 	}()
 	
 	// Collect results
+	distroStats := make(map[string]DistroStat)
 	for r := range results {
-		totalFiles += r.files
-		totalSize += r.size
 		distroStats[r.distro] = DistroStat{Files: r.files, Size: r.size}
 	}
 	
-	// Update global stats
+	if err := ctx.Err(); err != nil {
+		endScan(scan, nil)
+		return 0, 0, err
+	}
+	totalFiles, totalSize := endScan(scan, distroStats)
+	return totalFiles, totalSize, nil
+}
+
+// beginScan starts recording file changes for a scan
+func beginScan(ctx context.Context) *fileScan {
+	scan := &fileScan{
+		ctx:     ctx,
+		dirs:    make(map[string]dirState),
+		journal: make(map[string][]fileChange),
+		distros: make(map[string]DistroStat),
+	}
+	fileStats.mu.Lock()
+	fileStats.scan = scan
+	fileStats.mu.Unlock()
+	return scan
+}
+
+// record files a change under the nearest directory the scan knows about.
+// A directory with no state whose parent is already counted was created
+// after that listing, so the walk will never read it.
+func (scan *fileScan) record(c fileChange) {
+	dir := filepath.Dir(c.path)
+	for {
+		switch scan.dirs[dir] {
+		case dirScheduled:
+			return
+		case dirListing:
+			scan.journal[dir] = append(scan.journal[dir], c)
+			return
+		case dirCounted:
+			addDistroStat(scan.distros, c.distro, c.files, c.size)
+			return
+		}
+		
+		parent := filepath.Dir(dir)
+		if parent == dir {
+			return // the scan hasn't listed storage yet
+		}
+		dir = parent
+	}
+}
+
+// countDir adds up the cached files below dir
+func (scan *fileScan) countDir(dir string, files, size *int64) {
+	if scan.ctx.Err() != nil {
+		return
+	}
+	
+	f, s, subdirs, _ := scan.listDir(dir)
+	*files += f
+	*size += s
+	
+	for _, sub := range subdirs {
+		scan.countDir(sub, files, size)
+	}
+}
+
+// listDir counts the cached files directly in dir and returns its
+// subdirectories. The directory is marked before it is read, so no change
+// made while reading it goes unseen.
+func (scan *fileScan) listDir(dir string) (files, size int64, subdirs []string, err error) {
+	fileStats.mu.Lock()
+	scan.dirs[dir] = dirListing
+	fileStats.mu.Unlock()
+	
+	counted := make(map[string]int64)
+	entries, err := os.ReadDir(dir)
+	for _, entry := range entries {
+		if entry.IsDir() {
+			subdirs = append(subdirs, filepath.Join(dir, entry.Name()))
+			continue
+		}
+		if !IsCachedFile(entry.Name()) {
+			continue
+		}
+		info, infoErr := entry.Info()
+		if infoErr != nil {
+			continue
+		}
+		counted[entry.Name()] = info.Size()
+		files++
+		size += info.Size()
+	}
+	
+	fileStats.mu.Lock()
+	scan.settle(dir, counted, subdirs)
+	fileStats.mu.Unlock()
+	
+	return files, size, subdirs, err
+}
+
+// settle replays the changes journalled while dir was being read against
+// what its listing counted, keeping only those the listing missed. counted
+// maps file names to the sizes seen and is consumed.
+func (scan *fileScan) settle(dir string, counted map[string]int64, subdirs []string) {
+	for _, sub := range subdirs {
+		scan.dirs[sub] = dirScheduled
+	}
+	
+	for _, c := range scan.journal[dir] {
+		if filepath.Dir(c.path) != dir {
+			// Below a subdirectory: it is read later if the listing found it
+			rel, _ := filepath.Rel(dir, c.path)
+			child, _, _ := strings.Cut(rel, string(filepath.Separator))
+			if _, ok := scan.dirs[filepath.Join(dir, child)]; !ok {
+				addDistroStat(scan.distros, c.distro, c.files, c.size)
+			}
+			continue
+		}
+		
+		name := filepath.Base(c.path)
+		seen, ok := counted[name]
+		if c.files > 0 {
+			// An add the listing already counted is dropped
+			if ok {
+				continue
+			}
+			counted[name] = c.size
+		} else {
+			// A remove only applies to the copy the listing counted; a
+			// different size means it saw the replacement instead
+			if !ok || seen != -c.size {
+				continue
+			}
+			delete(counted, name)
+		}
+		addDistroStat(scan.distros, c.distro, c.files, c.size)
+	}
+	
+	delete(scan.journal, dir)
+	scan.dirs[dir] = dirCounted
+}
+
+// endScan publishes a scan result together with the changes recorded while
+// it ran. A nil result means the scan failed and the counters are kept.
+func endScan(scan *fileScan, distroStats map[string]DistroStat) (int64, int64) {
 	fileStats.mu.Lock()
+	defer fileStats.mu.Unlock()
+	
+	fileStats.scan = nil
+	if distroStats == nil {
+		return fileStats.TotalFiles, fileStats.TotalSize
+	}
+	
+	for distro, ds := range scan.distros {
+		addDistroStat(distroStats, distro, ds.Files, ds.Size)
+	}
+	
+	var totalFiles, totalSize int64
+	for _, ds := range distroStats {
+		totalFiles += ds.Files
+		totalSize += ds.Size
+	}
+	
 	fileStats.TotalFiles = totalFiles
 	fileStats.TotalSize = totalSize
 	fileStats.DistroStats = distroStats
-	fileStats.mu.Unlock()
-	
-	log.Debugf("File stats updated: %d files, %.2f MB", totalFiles, float64(totalSize)/(1024*1024))
-	return nil
+	fileStats.ready = true
+	return totalFiles, totalSize
 }
 
 // AddLog adds a log entry to the buffer
 func AddLog(message, level string) {
-	logMu.Lock()
-	defer logMu.Unlock()
-	
 	entry := LogEntry{
 		Time:    time.Now().Format("15:04:05"),
 		Level:   level,
 		Message: message,
 	}
 	
-	logBuffer = append(logBuffer, entry)
-	if len(logBuffer) > maxLogSize {
-		logBuffer = logBuffer[1:]
+	logMu.Lock()
+	defer logMu.Unlock()
+	
+	logBuffer[logNext] = entry
+	logNext = (logNext + 1) % maxLogSize
+	if logCount < maxLogSize {
+		logCount++
 	}
 }
 
-// GetLogs returns recent log entries
+// GetLogs returns recent log entries, oldest first
 func GetLogs() []LogEntry {
 	logMu.Lock()
 	defer logMu.Unlock()
 	
-	logs := make([]LogEntry, len(logBuffer))
-	copy(logs, logBuffer)
+	logs := make([]LogEntry, 0, logCount)
+	start := (logNext - logCount + maxLogSize) % maxLogSize
+	if start+logCount <= maxLogSize {
+		logs = append(logs, logBuffer[start:start+logCount]...)
+	} else {
+		logs = append(logs, logBuffer[start:]...)
+		logs = append(logs, logBuffer[:logNext]...)
+	}
 	return logs
 }
 
 // LoadFromDB loads statistics from database
 func LoadFromDB() error {
-	db := database.Get()
+	db := database.Reader()
 	log := logger.Get()
 	
 	rows, err := db.Query("SELECT key, value FROM stats")
@@ -212,6 +488,7 @@ func LoadFromDB() error {
 	}
 	defer rows.Close()
 	
+	loaded := make(map[string]uint64)
 	for rows.Next() {
 		var key string
 		var value uint64
@@ -229,15 +506,20 @@ func LoadFromDB() error {
 		case "bytes_served":
 			atomic.StoreUint64(&stats.BytesServed, value)
 		}
+		loaded[key] = value
 	}
 	
+	lastSavedMu.Lock()
+	lastSaved = loaded
+	lastSavedMu.Unlock()
+	
 	log.Info("Stats loaded from database")
 	return nil
 }
 
 // SaveToDB saves statistics to database
 func SaveToDB() error {
-	db := database.Get()
+	db := database.Writer()
 	
 	statsMap := map[string]uint64{
 		"requests_total": atomic.LoadUint64(&stats.RequestsTotal),
@@ -246,6 +528,14 @@ func SaveToDB() error {
 		"bytes_served":   atomic.LoadUint64(&stats.BytesServed),
 	}
 	
+	lastSavedMu.Lock()
+	defer lastSavedMu.Unlock()
+	
+	// Skip the write transaction entirely while the proxy is idle
+	if statsEqual(statsMap, lastSaved) {
+		return nil
+	}
+	
 	tx, err := db.Begin()
 	if err != nil {
 		return err
@@ -264,5 +554,21 @@ func SaveToDB() error {
 		}
 	}
 	
-	return tx.Commit()
+	if err := tx.Commit(); err != nil {
+		return err
+	}
+	lastSaved = statsMap
+	return nil
+}
+
+func statsEqual(a, b map[string]uint64) bool {
+	if len(a) != len(b) {
+		return false
+	}
+	for key, value := range a {
+		if saved, ok := b[key]; !ok || saved != value {
+			return false
+		}
+	}
+	return true
 }
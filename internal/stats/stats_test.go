@@ -0,0 +1,191 @@
+package stats
+
+import (
+	"context"
+	"os"
+	"path/filepath"
+	"testing"
+)
+
+func resetFileStats() {
+	fileStats.mu.Lock()
+	fileStats.TotalFiles = 0
+	fileStats.TotalSize = 0
+	fileStats.DistroStats = make(map[string]DistroStat)
+	fileStats.ready = false
+	fileStats.scan = nil
+	fileStats.mu.Unlock()
+}
+
+func writeCacheFile(t *testing.T, path string, size int) {
+	t.Helper()
+	if err := os.MkdirAll(filepath.Dir(path), 0755); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.WriteFile(path, make([]byte, size), 0644); err != nil {
+		t.Fatal(err)
+	}
+}
+
+func checkFileStats(t *testing.T, files, size int64, distros map[string]DistroStat) {
+	t.Helper()
+	fileStats.mu.RLock()
+	defer fileStats.mu.RUnlock()
+
+	if fileStats.TotalFiles != files || fileStats.TotalSize != size {
+		t.Errorf("totals = %d files, %d bytes; want %d files, %d bytes",
+			fileStats.TotalFiles, fileStats.TotalSize, files, size)
+	}
+	for distro, want := range distros {
+		if got := fileStats.DistroStats[distro]; got != want {
+			t.Errorf("%s = %+v; want %+v", distro, got, want)
+		}
+	}
+}
+
+func TestScanCountsCachedFilesOnly(t *testing.T) {
+	resetFileStats()
+	root := t.TempDir()
+	writeCacheFile(t, filepath.Join(root, "debian", "aa", "aa01_a.deb"), 10)
+	writeCacheFile(t, filepath.Join(root, "debian", "aa", "aa01_a.deb.meta"), 3)
+	writeCacheFile(t, filepath.Join(root, "debian", "bb", "bb01_b.deb"), 20)
+	writeCacheFile(t, filepath.Join(root, "ubuntu", "cc", "cc01_c.deb.1234.tmp"), 5)
+
+	if _, _, err := scanStorage(context.Background(), root); err != nil {
+		t.Fatal(err)
+	}
+	checkFileStats(t, 2, 30, map[string]DistroStat{
+		"debian": {Files: 2, Size: 30},
+		"ubuntu": {},
+	})
+}
+
+func TestRemoveBeforeFirstScan(t *testing.T) {
+	resetFileStats()
+	root := t.TempDir()
+	deb := filepath.Join(root, "debian", "aa", "aa01_a.deb")
+	writeCacheFile(t, deb, 10)
+
+	// A removal before the first scan must not drive the counters negative
+	adjustFileStats(root, filepath.Join(root, "debian", "aa", "aa02_gone.deb"), -1, -40)
+	checkFileStats(t, 0, 0, nil)
+
+	if _, _, err := scanStorage(context.Background(), root); err != nil {
+		t.Fatal(err)
+	}
+	checkFileStats(t, 1, 10, map[string]DistroStat{"debian": {Files: 1, Size: 10}})
+
+	// Once scanned, changes are counted incrementally
+	adjustFileStats(root, deb, -1, -10)
+	checkFileStats(t, 0, 0, map[string]DistroStat{"debian": {}})
+}
+
+func TestChangesDuringScan(t *testing.T) {
+	resetFileStats()
+	root := t.TempDir()
+	writeCacheFile(t, filepath.Join(root, "debian", "aa", "aa01_a.deb"), 10)
+	writeCacheFile(t, filepath.Join(root, "debian", "bb", "bb01_b.deb"), 20)
+	ubuntu := filepath.Join(root, "ubuntu", "cc", "cc01_c.deb")
+	writeCacheFile(t, ubuntu, 30)
+
+	if _, _, err := scanStorage(context.Background(), root); err != nil {
+		t.Fatal(err)
+	}
+
+	scan := beginScan(context.Background())
+	distroStats := make(map[string]DistroStat)
+
+	var files, size int64
+	scan.countDir(filepath.Join(root, "debian"), &files, &size)
+	distroStats["debian"] = DistroStat{Files: files, Size: size}
+
+	// Added in a directory the scan already read: only the delta sees it
+	added := filepath.Join(root, "debian", "aa", "aa02_new.deb")
+	writeCacheFile(t, added, 40)
+	adjustFileStats(root, added, 1, 40)
+
+	// Removed from a directory the scan has yet to read: only disk shows it
+	if err := os.Remove(ubuntu); err != nil {
+		t.Fatal(err)
+	}
+	adjustFileStats(root, ubuntu, -1, -30)
+
+	files, size = 0, 0
+	scan.countDir(filepath.Join(root, "ubuntu"), &files, &size)
+	distroStats["ubuntu"] = DistroStat{Files: files, Size: size}
+
+	// The live counters stay current while the scan runs
+	checkFileStats(t, 3, 70, nil)
+
+	endScan(scan, distroStats)
+	checkFileStats(t, 3, 70, map[string]DistroStat{
+		"debian": {Files: 3, Size: 70},
+		"ubuntu": {},
+	})
+}
+
+func TestDirectoryCreatedDuringScan(t *testing.T) {
+	resetFileStats()
+	root := t.TempDir()
+	writeCacheFile(t, filepath.Join(root, "debian", "aa", "aa01_a.deb"), 10)
+
+	if _, _, err := scanStorage(context.Background(), root); err != nil {
+		t.Fatal(err)
+	}
+
+	scan := beginScan(context.Background())
+	var files, size int64
+	scan.countDir(filepath.Join(root, "debian"), &files, &size)
+
+	// A shard created after debian/ was listed is never walked
+	added := filepath.Join(root, "debian", "zz", "zz01_new.deb")
+	writeCacheFile(t, added, 40)
+	adjustFileStats(root, added, 1, 40)
+
+	endScan(scan, map[string]DistroStat{"debian": {Files: files, Size: size}})
+	checkFileStats(t, 2, 50, map[string]DistroStat{"debian": {Files: 2, Size: 50}})
+}
+
+func TestChangesWhileListing(t *testing.T) {
+	tests := []struct {
+		name    string
+		counted map[string]int64 // what the listing saw
+	}{
+		{"listing saw the replacement", map[string]int64{"a.deb": 10, "b.deb": 20, "d.deb": 40}},
+		{"listing saw the original", map[string]int64{"a.deb": 10, "b.deb": 20, "d.deb": 30}},
+	}
+
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			resetFileStats()
+			root := t.TempDir()
+			dir := filepath.Join(root, "debian", "aa")
+
+			scan := beginScan(context.Background())
+			fileStats.mu.Lock()
+			scan.dirs[dir] = dirListing
+			fileStats.mu.Unlock()
+
+			// Changes made while dir is being read; on disk it ends up
+			// holding a (10), b (20), c (5) and d (40)
+			adjustFileStats(root, filepath.Join(dir, "b.deb"), 1, 20)
+			adjustFileStats(root, filepath.Join(dir, "c.deb"), 1, 5)
+			adjustFileStats(root, filepath.Join(dir, "e.deb"), -1, -7)
+			adjustFileStats(root, filepath.Join(dir, "d.deb"), -1, -30)
+			adjustFileStats(root, filepath.Join(dir, "d.deb"), 1, 40)
+
+			var listed DistroStat
+			for _, size := range tt.counted {
+				listed.Files++
+				listed.Size += size
+			}
+
+			fileStats.mu.Lock()
+			scan.settle(dir, tt.counted, nil)
+			fileStats.mu.Unlock()
+
+			endScan(scan, map[string]DistroStat{"debian": listed})
+			checkFileStats(t, 4, 75, map[string]DistroStat{"debian": {Files: 4, Size: 75}})
+		})
+	}
+}
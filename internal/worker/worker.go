@@ -2,6 +2,7 @@ package worker
 
 import (
 	"context"
+	"sync"
 	"time"
 
 	"apt-cache-proxy/internal/cache"
@@ -9,19 +10,36 @@ import (
 	"apt-cache-proxy/internal/stats"
 )
 
+var wg sync.WaitGroup
+
 // Start starts the background worker pool
 func Start(ctx context.Context) {
 	log := logger.Get()
 	log.Info("Starting background workers")
 
 	// Worker 1: Save stats every minute
-	go statsSaver(ctx)
+	run(ctx, statsSaver)
 
-	// Worker 2: Update file stats every 5 minutes
-	go fileStatsUpdater(ctx)
+	// Worker 2: Reconcile file stats every hour; cache writes and removals
+	// keep them current in between
+	run(ctx, fileStatsUpdater)
 
 	// Worker 3: Clean cache every hour
-	go cacheCleaner(ctx)
+	run(ctx, cacheCleaner)
+}
+
+// Wait blocks until all workers have returned after their context is
+// cancelled, so a final stats save cannot race a scheduled one
+func Wait() {
+	wg.Wait()
+}
+
+func run(ctx context.Context, worker func(context.Context)) {
+	wg.Add(1)
+	go func() {
+		defer wg.Done()
+		worker(ctx)
+	}()
 }
 
 func statsSaver(ctx context.Context) {
@@ -44,7 +62,7 @@ func statsSaver(ctx context.Context) {
 
 func fileStatsUpdater(ctx context.Context) {
 	log := logger.Get()
-	ticker := time.NewTicker(5 * time.Minute)
+	ticker := time.NewTicker(1 * time.Hour)
 	defer ticker.Stop()
 
 	for {
@@ -54,7 +72,7 @@ func fileStatsUpdater(ctx context.Context) {
 			return
 		case <-ticker.C:
 			log.Debug("Updating file stats...")
-			if err := stats.UpdateFileStats(); err != nil {
+			if err := stats.UpdateFileStats(ctx); err != nil && ctx.Err() == nil {
 				log.Errorf("Failed to update file stats: %v", err)
 			}
 		}
@@ -73,7 +91,10 @@ func cacheCleaner(ctx context.Context) {
 			return
 		case <-ticker.C:
 			log.Info("Running cache cleanup...")
-			if err := cache.CleanOldCache(); err != nil {
+			if err := cache.CleanStaleTempFiles(ctx); err != nil && ctx.Err() == nil {
+				log.Errorf("Temp file cleanup failed: %v", err)
+			}
+			if err := cache.CleanOldCache(ctx); err != nil && ctx.Err() == nil {
 				log.Errorf("Cache cleanup failed: %v", err)
 			}
 		}
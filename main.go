@@ -47,17 +47,23 @@ func main() {
 		log.Warnf("Failed to load blacklist from DB: %v", err)
 	}
 
-	// Initialize stats with file scan
+	// Background work stops when workerCtx is cancelled at shutdown
+	workerCtx, workerCancel := context.WithCancel(context.Background())
+	defer workerCancel()
+
+	// Clear temp files left by a crash, then initialize stats with file scan
 	go func() {
+		if err := cache.CleanStaleTempFiles(workerCtx); err != nil && workerCtx.Err() == nil {
+			log.Errorf("Temp file cleanup failed: %v", err)
+		}
+		
 		log.Info("Starting initial file stats scan...")
-		if err := stats.UpdateFileStats(); err != nil {
+		if err := stats.UpdateFileStats(workerCtx); err != nil && workerCtx.Err() == nil {
 			log.Errorf("Initial file stats update failed: %v", err)
 		}
 	}()
 
 	// Start background worker pool
-	workerCtx, workerCancel := context.WithCancel(context.Background())
-	defer workerCancel()
 	worker.Start(workerCtx)
 
 	// Initialize proxy handler
@@ -92,8 +98,9 @@ func main() {
 		log.Errorf("Server forced to shutdown: %v", err)
 	}
 
-	// Cancel background workers
+	// Cancel background workers and let in-flight tasks finish
 	workerCancel()
+	worker.Wait()
 
 	// Save final stats
 	if err := stats.SaveToDB(); err != nil {